@@ -0,0 +1,98 @@
+"""Measure routing throughput on a city-sized road graph.
+
+Usage: python bench_routing.py [road_graph.json.gz]
+
+Without a file, a synthetic city is generated: a perturbed street grid with
+some one-way streets and faster arterials every tenth row and column.
+BENCH_GRID_SIZE sets its side length (default 150, i.e. 22,500 nodes).
+"""
+import os
+import random
+import sys
+import time
+
+from routing import RoadGraph, Router, contract, load_graph
+
+GRID_SIZE = int(os.getenv("BENCH_GRID_SIZE", "150"))
+QUERIES = 2000
+BATCH = 50
+
+
+def synthetic_city(size, seed=42):
+    rng = random.Random(seed)
+    spacing = 0.0015  # roughly 150 m between intersections
+    lats, lngs, edges = [], [], []
+    for row in range(size):
+        for col in range(size):
+            lats.append(28.5 + row * spacing + rng.uniform(-0.0003, 0.0003))
+            lngs.append(77.1 + col * spacing + rng.uniform(-0.0003, 0.0003))
+    for node in range(size * size):
+        row, col = divmod(node, size)
+        for other, arterial in ((node + 1, row % 10 == 0), (node + size, col % 10 == 0)):
+            if (other == node + 1 and col == size - 1) or other >= size * size:
+                continue
+            seconds = 150 / (60 if arterial else 25) * 3.6 * rng.uniform(0.8, 1.3)
+            if not arterial and rng.random() < 0.15:
+                u, v = (node, other) if rng.random() < 0.5 else (other, node)
+                edges.append((u, v, seconds))
+            else:
+                edges.append((node, other, seconds))
+                edges.append((other, node, seconds))
+    return lats, lngs, edges
+
+
+def random_point(graph, rng):
+    node = rng.randrange(len(graph))
+    return (graph.lats[node] + rng.uniform(-0.0005, 0.0005),
+            graph.lngs[node] + rng.uniform(-0.0005, 0.0005))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        started = time.perf_counter()
+        graph = load_graph(sys.argv[1])
+        print(f"Loaded {len(graph)} nodes in {time.perf_counter() - started:.1f}s")
+    else:
+        lats, lngs, edges = synthetic_city(GRID_SIZE)
+        started = time.perf_counter()
+        rank, all_edges = contract(len(lats), edges)
+        print(f"Synthetic city: {len(lats)} nodes, {len(edges)} edges, "
+              f"contracted in {time.perf_counter() - started:.1f}s "
+              f"({len(all_edges) - len(edges)} shortcuts)")
+        graph = RoadGraph(lats, lngs, rank, all_edges)
+
+    # Points at the poles or far from the graph must be rejected quickly,
+    # since the API accepts any latitude in [-90, 90].
+    started = time.perf_counter()
+    for lat, lng in ((90.0, 0.0), (-90.0, 0.0), (89.9, 77.1), (0.0, 0.0)):
+        assert graph.nearest(lat, lng) is None
+    elapsed = time.perf_counter() - started
+    assert elapsed < 0.05, f"off-graph snapping took {elapsed * 1000:.1f}ms"
+    print(f"off-graph snapping:       {elapsed * 1000:>10.2f} ms for 4 points")
+
+    rng = random.Random(7)
+    pairs = [(random_point(graph, rng), random_point(graph, rng)) for _ in range(QUERIES)]
+
+    router = Router(graph, cache_size=0)
+    started = time.perf_counter()
+    for source, target in pairs:
+        router.travel_time(source, target)
+    elapsed = time.perf_counter() - started
+    print(f"one-to-one, uncached:     {QUERIES / elapsed:>10.0f} queries/s")
+
+    batches = [([random_point(graph, rng) for _ in range(BATCH)], random_point(graph, rng))
+               for _ in range(QUERIES // BATCH)]
+    started = time.perf_counter()
+    for sources, target in batches:
+        router.travel_times(sources, target)
+    elapsed = time.perf_counter() - started
+    print(f"many-to-one ({BATCH}), uncached: {QUERIES / elapsed:>10.0f} pairs/s")
+
+    router = Router(graph)
+    for source, target in pairs:
+        router.travel_time(source, target)
+    started = time.perf_counter()
+    for source, target in pairs:
+        router.travel_time(source, target)
+    elapsed = time.perf_counter() - started
+    print(f"one-to-one, cached:       {QUERIES / elapsed:>10.0f} queries/s")
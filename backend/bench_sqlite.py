@@ -0,0 +1,116 @@
+"""Compare database throughput for the location-ping / job-polling workload.
+
+Runs the same mix of writes (mechanic location pings, request inserts) and
+reads (pending-request polling) from several threads against:
+
+  * SQLite with default settings
+  * SQLite with the tuned profile from database.py (WAL, pragmas, writer queue)
+  * Postgres, if BENCH_POSTGRES_URL is set. Point it at a scratch database:
+    the users and service_requests tables are dropped and recreated.
+
+Usage: python bench_sqlite.py [threads] [seconds]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import random
+
+from sqlalchemy.exc import OperationalError
+
+# database.py builds its app engine from DATABASE_URL at import time. The
+# benchmark creates its own engines, so make sure that import doesn't need a
+# Postgres driver when no .env is present.
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from database import Base, make_engine, make_sessionmaker
+import models
+
+THREADS = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+MECHANICS = 50
+
+
+def seed(factory):
+    db = factory()
+    for i in range(MECHANICS):
+        db.add(models.User(
+            name=f"Mechanic {i}", email=f"bench-mechanic-{i}@example.com",
+            password_hash="x", phone="9999999999", role="mechanic",
+            is_available=True, latitude=28.6, longitude=77.2,
+        ))
+    db.commit()
+    ids = [u.id for u in db.query(models.User.id).all()]
+    db.close()
+    return ids
+
+
+def worker(factory, mechanic_ids, deadline, counts, lock):
+    ops = errors = 0
+    while time.perf_counter() < deadline:
+        db = factory()
+        try:
+            roll = random.random()
+            if roll < 0.6:
+                user = db.get(models.User, random.choice(mechanic_ids))
+                user.latitude = 28.6 + random.uniform(-0.1, 0.1)
+                user.longitude = 77.2 + random.uniform(-0.1, 0.1)
+                db.commit()
+            elif roll < 0.7:
+                db.add(models.ServiceRequest(
+                    customer_id=random.choice(mechanic_ids), vehicle_type="car",
+                    problem_desc="benchmark request", lat=28.6, lng=77.2,
+                    status="Pending",
+                ))
+                db.commit()
+            else:
+                db.query(models.ServiceRequest).filter(
+                    models.ServiceRequest.status == "Pending"
+                ).limit(50).all()
+            ops += 1
+        except OperationalError:
+            db.rollback()
+            errors += 1
+        finally:
+            db.close()
+    with lock:
+        counts["ops"] += ops
+        counts["errors"] += errors
+
+
+def run(label, url, tuned=True):
+    engine = make_engine(url, tuned=tuned)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    factory = make_sessionmaker(engine, tuned=tuned)
+    mechanic_ids = seed(factory)
+
+    counts = {"ops": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + SECONDS
+    threads = [
+        threading.Thread(target=worker, args=(factory, mechanic_ids, deadline, counts, lock))
+        for _ in range(THREADS)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+    print(f"{label:<16} {counts['ops'] / SECONDS:>10.0f} ops/s {counts['errors']:>8} errors")
+
+
+if __name__ == "__main__":
+    print(f"{THREADS} threads, {SECONDS:.0f}s per run")
+    with tempfile.TemporaryDirectory() as tmp:
+        run("sqlite default", f"sqlite:///{os.path.join(tmp, 'default.db')}", tuned=False)
+        run("sqlite tuned", f"sqlite:///{os.path.join(tmp, 'tuned.db')}")
+
+    postgres_url = os.getenv("BENCH_POSTGRES_URL")
+    if postgres_url:
+        run("postgres", postgres_url)
+    else:
+        print("postgres         skipped (set BENCH_POSTGRES_URL)")
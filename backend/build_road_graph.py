@@ -0,0 +1,110 @@
+"""Build the road graph used by routing.py from an OpenStreetMap XML extract.
+
+Usage: python build_road_graph.py city.osm road_graph.json.gz
+
+Download a city extract once (e.g. from a Geofabrik or BBBike export) and
+point ROAD_GRAPH_PATH at the output. The contraction hierarchy is computed
+here so the API only has to load the file at startup.
+"""
+import gzip
+import json
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from routing import calculate_distance, contract
+
+# Default speeds in km/h when a way has no usable maxspeed tag.
+SPEEDS_KMH = {
+    "motorway": 90, "motorway_link": 50,
+    "trunk": 70, "trunk_link": 40,
+    "primary": 55, "primary_link": 35,
+    "secondary": 45, "secondary_link": 30,
+    "tertiary": 35, "tertiary_link": 25,
+    "unclassified": 25, "residential": 20,
+    "living_street": 10, "service": 15,
+}
+
+
+def parse_speed(tags):
+    value = tags.get("maxspeed", "").split(";")[0].strip().lower()
+    factor = 1.0
+    if value.endswith("mph"):
+        value, factor = value[:-3], 1.609
+    elif value.endswith("km/h"):
+        value = value[:-4]
+    try:
+        kmh = float(value) * factor
+    except ValueError:
+        kmh = 0
+    # Zero or negative speeds would give infinite or negative edge costs
+    return kmh if kmh > 0 else SPEEDS_KMH[tags["highway"]]
+
+
+def read_osm(path):
+    coords = {}
+    ways = []
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "node":
+            coords[elem.get("id")] = (float(elem.get("lat")), float(elem.get("lon")))
+            elem.clear()
+        elif elem.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+            if tags.get("highway") in SPEEDS_KMH:
+                refs = [nd.get("ref") for nd in elem.iter("nd")]
+                ways.append((refs, tags))
+            elem.clear()
+    return coords, ways
+
+
+def build(coords, ways):
+    index = {}
+    lats, lngs, edges = [], [], []
+
+    def node_id(ref):
+        if ref not in index:
+            index[ref] = len(lats)
+            lat, lng = coords[ref]
+            lats.append(lat)
+            lngs.append(lng)
+        return index[ref]
+
+    for refs, tags in ways:
+        refs = [ref for ref in refs if ref in coords]
+        oneway = tags.get("oneway", "no")
+        if tags.get("junction") == "roundabout" or tags["highway"].startswith("motorway"):
+            oneway = tags.get("oneway", "yes")
+        if oneway == "-1":
+            refs = refs[::-1]
+        mps = parse_speed(tags) / 3.6
+        for a, b in zip(refs, refs[1:]):
+            u, v = node_id(a), node_id(b)
+            seconds = calculate_distance(lats[u], lngs[u], lats[v], lngs[v]) * 1000 / mps
+            edges.append((u, v, seconds))
+            if oneway not in ("yes", "true", "1", "-1"):
+                edges.append((v, u, seconds))
+    return lats, lngs, edges
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    source, target = sys.argv[1], sys.argv[2]
+
+    coords, ways = read_osm(source)
+    lats, lngs, edges = build(coords, ways)
+    print(f"Read {len(lats)} road nodes and {len(edges)} edges")
+
+    started = time.perf_counter()
+    rank, edges = contract(len(lats), edges)
+    print(f"Contracted in {time.perf_counter() - started:.1f}s, {len(edges)} edges with shortcuts")
+
+    opener = gzip.open if target.endswith(".gz") else open
+    with opener(target, "wt") as f:
+        json.dump({
+            "lat": lats,
+            "lng": lngs,
+            "edges": [[u, v, round(w, 2)] for u, v, w in edges],
+            "rank": rank,
+        }, f)
+    print(f"✅ Road graph written to {target}")
@@ -1,12 +1,15 @@
 from fastapi import FastAPI, Depends, HTTPException, status,Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.orm import Session
 from database import engine, get_db
 import jwt
 from typing import List
-import models, schemas, auth
-import math
+import models, schemas, auth, routing
+from routing import calculate_distance
+from tracking import trails
+from profiling import profiler, slow_requests, SlowRequestMiddleware, TimedRoute, TimedJSONResponse, MAX_PROFILE_SECONDS
 import logging
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
@@ -18,7 +21,8 @@ load_dotenv()
 
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Roadside Rescue API")
+app = FastAPI(title="Roadside Rescue API", default_response_class=TimedJSONResponse)
+app.router.route_class = TimedRoute
 
 origins = [
     "http://localhost:5173", 
@@ -27,6 +31,8 @@ origins = [
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:5173,http://127.0.0.1:5173")
 origins = [origin.strip() for origin in CORS_ORIGINS.split(",")]
 
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -34,6 +40,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(SlowRequestMiddleware, capture=slow_requests)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
@@ -52,15 +59,7 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    R = 6371
-    dLat = math.radians(lat2 - lat1)
-    dLon = math.radians(lon2 - lon1)
-    a = (math.sin(dLat / 2) * math.sin(dLat / 2) +
-         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
-         math.sin(dLon / 2) * math.sin(dLon / 2))
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+router = routing.load_router()
 
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
@@ -75,6 +74,12 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
+def get_admin_user(current_user: models.User = Depends(get_current_user)):
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return current_user
+
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to roadside rescue API"}
@@ -93,7 +98,8 @@ def register(request:Request,user: schemas.UserCreate, db: Session = Depends(get
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = auth.get_password_hash(user.password)
+    with slow_requests.stage("password_hash"):
+        hashed_password = auth.get_password_hash(user.password)
     
     new_user = models.User(
         name=user.name,
@@ -114,7 +120,9 @@ def register(request:Request,user: schemas.UserCreate, db: Session = Depends(get
 @limiter.limit("10/minute")
 def login(request: Request,form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.password_hash):
+    with slow_requests.stage("password_hash"):
+        password_ok = user is not None and auth.verify_password(form_data.password, user.password_hash)
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="incorrect email or password",
@@ -212,6 +220,7 @@ def reject_request(request_id: int, current_user: models.User = Depends(get_curr
     current_user.is_available = True
     
     db.commit()
+    trails.stop(req.id)
     return {"status": "Rejected"}
 
 @app.post("/requests/{request_id}/rate")
@@ -266,15 +275,25 @@ def get_nearby_requests(current_user: models.User = Depends(get_current_user),
     lng_range = 0.45
     
     nearby = []
-    for req in pending_requests:
-        if current_user.latitude is not None and current_user.longitude is not None:
-            dist = calculate_distance(current_user.latitude, current_user.longitude, req.lat, req.lng)
-            logger.debug(f"Request {req.id} Distance: {dist:.2f} km")
+    with slow_requests.stage("distance"):
+        for req in pending_requests:
+            if current_user.latitude is not None and current_user.longitude is not None:
+                dist = calculate_distance(current_user.latitude, current_user.longitude, req.lat, req.lng)
+                logger.debug(f"Request {req.id} Distance: {dist:.2f} km")
             
-            if dist <50:
-                nearby.append(req)
-        else:
-            logger.debug("Skipping request: Mechanic has no location set.")
+                if dist <50:
+                    nearby.append(req)
+            else:
+                logger.debug("Skipping request: Mechanic has no location set.")
+    
+    # Rank by road travel time rather than straight-line distance
+    with slow_requests.stage("routing"):
+        etas = router.travel_times_from(
+            (current_user.latitude, current_user.longitude),
+            [(req.lat, req.lng) for req in nearby]
+        )
+    ranked = sorted(zip(etas, nearby), key=lambda pair: float("inf") if pair[0] is None else pair[0])
+    nearby = [req for eta, req in ranked]
 
     logger.info(f"Returning {len(nearby)} requests")
 
@@ -295,10 +314,21 @@ def update_mechanic_location(
     if not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
         raise HTTPException(status_code=400, detail="Invalid coordinates")
     
+    # Read before commit, which expires the user and would reload it
+    mechanic_id = current_user.id
     current_user.latitude = lat
     current_user.longitude = lng
     db.commit()
     
+    if not trails.record(mechanic_id, lat, lng) and trails.should_look_up(mechanic_id):
+        # Trails live in memory, so pick up an en-route job again after a restart
+        en_route = db.query(models.ServiceRequest.id).filter(
+            models.ServiceRequest.mechanic_id == mechanic_id,
+            models.ServiceRequest.status == "En Route"
+        ).first()
+        if en_route:
+            trails.resume(en_route.id, mechanic_id, lat, lng)
+    
     return {"message": "Location updated", "lat": lat, "lng": lng}
 
 @app.post("/requests/{request_id}/accept")
@@ -369,6 +399,54 @@ def get_request(request_id: int,
     
     return response
 
+@app.get("/requests/{request_id}/track", response_model=schemas.TrackResponse)
+def track_request(request_id: int, cursor: int = 0,
+                  current_user: models.User = Depends(get_current_user),
+                  db: Session = Depends(get_db)):
+    
+    req = db.query(models.ServiceRequest).filter(
+        models.ServiceRequest.id == request_id
+    ).first()
+    if not req:
+        raise HTTPException(status_code=404, detail="Request not found")
+    if req.customer_id != current_user.id and req.mechanic_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    response = {
+        "request_id": req.id,
+        "status": req.status,
+        "latest": None,
+        "points": [],
+        "cursor": cursor,
+        "eta_minutes": None
+    }
+    if req.status != "En Route":
+        return response
+    
+    snapshot = trails.snapshot(req.id, cursor)
+    if snapshot is None:
+        # Trails live in memory, so start again from the last known position after a restart
+        mechanic = db.query(models.User).filter(models.User.id == req.mechanic_id).first()
+        if not mechanic:
+            return response
+        trails.resume(req.id, mechanic.id, mechanic.latitude, mechanic.longitude)
+        snapshot = trails.snapshot(req.id, cursor)
+        if snapshot is None:
+            return response
+    
+    latest, points, new_cursor = snapshot
+    if latest:
+        response["latest"] = {"lat": latest[0], "lng": latest[1], "ts": latest[2]}
+        eta = router.travel_time((latest[0], latest[1]), (req.lat, req.lng))
+        if eta is not None:
+            response["eta_minutes"] = round(eta / 60, 1)
+    response["points"] = [
+        {"seq": seq, "lat": lat, "lng": lng, "ts": ts}
+        for seq, lat, lng, ts in points
+    ]
+    response["cursor"] = new_cursor
+    return response
+
 VALID_TRANSITIONS = {
     "Pending": ["Accepted", "Cancelled", "Rejected"],
     "Accepted": ["En Route", "Rejected"],
@@ -405,8 +483,13 @@ def start_trip(request_id: int,
             detail=f"Cannot start trip from status '{req.status}'. Must be 'Accepted'."
         )
     
+    # Read before commit, which expires both objects and would reload them
+    job_id = req.id
+    mechanic_id = current_user.id
+    lat, lng = current_user.latitude, current_user.longitude
     req.status = "En Route"
     db.commit()
+    trails.start(job_id, mechanic_id, lat, lng)
     
     return {"status": "en_route", "message": "You are now en route to the customer"}
 
@@ -435,6 +518,7 @@ def complete_job(request_id: int,
     req.status = "Completed"
     current_user.is_available = True
     db.commit()
+    trails.stop(req.id)
     
     return {"status": "completed", "message": "Job completed successfully!"}
 
@@ -468,4 +552,63 @@ def get_active_job(current_user: models.User = Depends(get_current_user),
             "name": customer.name,
             "phone": customer.phone
         } if customer else None
-    }
\ No newline at end of file
+    }
+
+
+@app.post("/admin/profiler/start")
+def start_profiler(seconds: int = 30, interval_ms: int = 10,
+                   admin: models.User = Depends(get_admin_user)):
+    if not (1 <= seconds <= MAX_PROFILE_SECONDS):
+        raise HTTPException(status_code=400, detail=f"seconds must be between 1 and {MAX_PROFILE_SECONDS}")
+    if not (1 <= interval_ms <= 1000):
+        raise HTTPException(status_code=400, detail="interval_ms must be between 1 and 1000")
+    if not profiler.start(seconds, interval_ms):
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    
+    logger.info(f"Admin {admin.id} started profiler for {seconds}s")
+    return {"status": "running", "seconds": seconds, "interval_ms": interval_ms}
+
+
+@app.get("/admin/profiler")
+def get_profiler_status(admin: models.User = Depends(get_admin_user)):
+    return {
+        "running": profiler.running,
+        "started_at": profiler.started_at,
+        "seconds": profiler.seconds,
+        "samples": profiler.samples
+    }
+
+
+@app.get("/admin/profiler/output", response_class=PlainTextResponse)
+def download_profile(admin: models.User = Depends(get_admin_user)):
+    if profiler.started_at is None:
+        raise HTTPException(status_code=404, detail="No profile has been recorded")
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={"Content-Disposition": 'attachment; filename="profile.folded"'}
+    )
+
+
+@app.post("/admin/slow-requests/enable")
+def enable_slow_request_capture(threshold_ms: float = 500,
+                                admin: models.User = Depends(get_admin_user)):
+    if threshold_ms <= 0:
+        raise HTTPException(status_code=400, detail="threshold_ms must be positive")
+    slow_requests.enable(engine, threshold_ms)
+    logger.info(f"Admin {admin.id} enabled slow request capture at {threshold_ms}ms")
+    return {"enabled": True, "threshold_ms": threshold_ms}
+
+
+@app.post("/admin/slow-requests/disable")
+def disable_slow_request_capture(admin: models.User = Depends(get_admin_user)):
+    slow_requests.disable()
+    return {"enabled": False}
+
+
+@app.get("/admin/slow-requests")
+def get_slow_requests(admin: models.User = Depends(get_admin_user)):
+    return {
+        "enabled": slow_requests.enabled,
+        "threshold_ms": slow_requests.threshold_ms,
+        "requests": list(slow_requests.requests)
+    }
@@ -0,0 +1,256 @@
+"""On-demand diagnostics for production latency spikes.
+
+* SamplingProfiler: samples every thread's Python stack for a fixed number of
+  seconds and renders the result in collapsed-stack format, which
+  flamegraph.pl, speedscope and inferno read directly.
+* SlowRequestCapture: when enabled, records requests slower than a threshold
+  together with their SQL statements and time spent per stage. TimedRoute and
+  TimedJSONResponse add the validation and serialization stages.
+
+Both are off by default. While off, the profiler has no thread, the SQL hooks
+are not attached to the engine and the middleware only checks one flag.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+MAX_PROFILE_SECONDS = 300
+MAX_CAPTURED_REQUESTS = 50
+MAX_STATEMENTS_PER_REQUEST = 100
+
+_NO_STAGE = nullcontext()
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stacks = Counter()
+        self._labels = {}
+        self.started_at = None
+        self.seconds = 0
+        self.samples = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds, interval_ms=10):
+        with self._lock:
+            if self.running:
+                return False
+            self._stacks = Counter()
+            self.samples = 0
+            self.seconds = seconds
+            self.started_at = datetime.utcnow()
+            self._thread = threading.Thread(
+                target=self._run, args=(seconds, interval_ms / 1000),
+                name="sampling-profiler", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _run(self, seconds, interval):
+        own_id = threading.get_ident()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stack.reverse()
+                self._stacks[";".join(stack)] += 1
+            self.samples += 1
+            time.sleep(interval)
+
+    def collapsed(self):
+        """Folded stacks, one `frame;frame;frame count` line per unique stack."""
+        stacks = self._stacks.copy()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class RequestTrace:
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.stages = Counter()
+        self.statements = []
+
+
+_current_trace = ContextVar("current_trace", default=None)
+
+
+class _Stage:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.trace.stages[self.name] += (time.perf_counter() - self.started) * 1000
+
+
+class SlowRequestCapture:
+    def __init__(self):
+        self.enabled = False
+        self.threshold_ms = None
+        self.requests = deque(maxlen=MAX_CAPTURED_REQUESTS)
+        self._engine = None
+
+    def enable(self, engine, threshold_ms):
+        self.threshold_ms = threshold_ms
+        if not self.enabled:
+            event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+            self._engine = engine
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            self.enabled = False
+            event.remove(self._engine, "before_cursor_execute", _before_cursor_execute)
+            event.remove(self._engine, "after_cursor_execute", _after_cursor_execute)
+            self._engine = None
+
+    def stage(self, name):
+        """Time a block of work as `name` for the request being traced."""
+        if not self.enabled:
+            return _NO_STAGE
+        trace = _current_trace.get()
+        if trace is None:
+            return _NO_STAGE
+        return _Stage(trace, name)
+
+    def finish(self, trace, status_code):
+        duration_ms = (time.perf_counter() - trace.started) * 1000
+        if self.threshold_ms is None or duration_ms < self.threshold_ms:
+            return
+        stages = {name: round(ms, 2) for name, ms in trace.stages.items()}
+        stages["other"] = round(max(0.0, duration_ms - sum(trace.stages.values())), 2)
+        self.requests.append({
+            "method": trace.method,
+            "path": trace.path,
+            "status_code": status_code,
+            "duration_ms": round(duration_ms, 2),
+            "captured_at": datetime.utcnow().isoformat(),
+            "stages_ms": stages,
+            "sql": trace.statements,
+        })
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _current_trace.get()
+    started = getattr(context, "_query_started", None)
+    if trace is None or started is None:
+        return
+    ms = (time.perf_counter() - started) * 1000
+    trace.stages["sql"] += ms
+    if len(trace.statements) < MAX_STATEMENTS_PER_REQUEST:
+        trace.statements.append({"statement": statement, "duration_ms": round(ms, 2)})
+
+
+class SlowRequestMiddleware:
+    """ASGI middleware feeding SlowRequestCapture; a pass-through while it is off."""
+
+    def __init__(self, app, capture):
+        self.app = app
+        self.capture = capture
+
+    async def __call__(self, scope, receive, send):
+        if not self.capture.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope["method"], scope["path"])
+        token = _current_trace.set(trace)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            self.capture.finish(trace, status_code)
+
+
+profiler = SamplingProfiler()
+slow_requests = SlowRequestCapture()
+
+
+def _timed(func, name):
+    def wrapper(*args, **kwargs):
+        with slow_requests.stage(name):
+            return func(*args, **kwargs)
+    wrapper.timed = True
+    return wrapper
+
+
+def _time_field(field, methods, name):
+    for method in methods:
+        func = getattr(field, method)
+        if not getattr(func, "timed", False):
+            setattr(field, method, _timed(func, name))
+
+
+def _time_dependant(dependant):
+    params = (dependant.path_params + dependant.query_params + dependant.header_params
+              + dependant.cookie_params + dependant.body_params)
+    for field in params:
+        _time_field(field, ("validate",), "validation")
+    for sub_dependant in dependant.dependencies:
+        _time_dependant(sub_dependant)
+
+
+class TimedRoute(APIRoute):
+    """Route whose pydantic work shows up as its own stage in slow-request captures.
+
+    Request parameters and bodies are validated through the ModelFields on the
+    route's dependant, and response models through its response field, so
+    wrapping those covers validation and serialization without touching the
+    request handler FastAPI builds.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _time_dependant(self.dependant)
+        if self.secure_cloned_response_field is not None:
+            _time_field(self.secure_cloned_response_field, ("validate", "serialize"), "serialization")
+
+
+class TimedJSONResponse(JSONResponse):
+    def render(self, content):
+        with slow_requests.stage("serialization"):
+            return super().render(content)
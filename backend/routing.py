@@ -0,0 +1,346 @@
+"""Offline road-network travel times.
+
+The road graph is a JSON file (optionally gzipped) produced by
+build_road_graph.py from an OpenStreetMap extract:
+
+    {"lat": [...], "lng": [...], "edges": [[u, v, seconds], ...], "rank": [...]}
+
+`rank` is the contraction-hierarchy node order and `edges` already contains
+the shortcuts, so loading is just building adjacency lists. A file without
+`rank` is contracted at load time, which is slow for large graphs.
+
+Queries run a bidirectional upward search over the hierarchy. Results are
+cached per (source cell, target cell) pair. Without a graph, or when a point
+is too far from any road, travel time falls back to straight-line distance
+at FALLBACK_SPEED_KMH.
+"""
+import gzip
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+
+ROAD_GRAPH_PATH = os.getenv("ROAD_GRAPH_PATH", "")
+ROUTE_CELL_DEG = float(os.getenv("ROUTE_CELL_DEG", "0.002"))
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "100000"))
+FALLBACK_SPEED_KMH = 30.0
+
+SNAP_GRID_DEG = 0.002
+MAX_SNAP_KM = 1.0
+# Longitude cells shrink towards the poles; flooring cos(lat) caps the search radius in cells.
+MIN_LNG_SCALE = 0.1
+WITNESS_SETTLE_LIMIT = 50
+
+INF = float("inf")
+
+logger = logging.getLogger(__name__)
+
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    R = 6371
+    dLat = math.radians(lat2 - lat1)
+    dLon = math.radians(lon2 - lon1)
+    a = (math.sin(dLat / 2) * math.sin(dLat / 2) +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
+         math.sin(dLon / 2) * math.sin(dLon / 2))
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+
+def _witness_search(out, contracted, source, skip, limit, targets):
+    # Bounded Dijkstra that ignores `skip` and contracted nodes. Tentative
+    # distances are lengths of real paths, so they are valid witnesses too.
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    remaining = len(targets)
+    settled = 0
+    while heap and settled < WITNESS_SETTLE_LIMIT:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        if d > limit:
+            break
+        settled += 1
+        if u in targets:
+            remaining -= 1
+            if remaining == 0:
+                break
+        for x, w in out[u].items():
+            if x == skip or contracted[x]:
+                continue
+            nd = d + w
+            if nd < dist.get(x, INF):
+                dist[x] = nd
+                heapq.heappush(heap, (nd, x))
+    return dist
+
+
+def contract(node_count, edges):
+    """Build a contraction hierarchy.
+
+    Returns (rank, edges) where `edges` is the input edge list plus the
+    shortcuts needed to keep upward searches exact.
+    """
+    out = [dict() for _ in range(node_count)]
+    inn = [dict() for _ in range(node_count)]
+    for u, v, w in edges:
+        if u != v and w < out[u].get(v, INF):
+            out[u][v] = w
+            inn[v][u] = w
+
+    contracted = [False] * node_count
+    deleted_neighbors = [0] * node_count
+    rank = [0] * node_count
+
+    def simulate(v):
+        shortcuts = []
+        outs = [(x, w) for x, w in out[v].items() if not contracted[x]]
+        ins = [(u, w) for u, w in inn[v].items() if not contracted[u]]
+        for u, w_in in ins:
+            targets = {}
+            for x, w_out in outs:
+                if x != u:
+                    targets[x] = w_in + w_out
+            if not targets:
+                continue
+            dist = _witness_search(out, contracted, u, v, max(targets.values()), targets)
+            for x, w in targets.items():
+                if dist.get(x, INF) > w:
+                    shortcuts.append((u, x, w))
+        priority = len(shortcuts) - len(outs) - len(ins) + deleted_neighbors[v]
+        return priority, shortcuts
+
+    heap = [(simulate(v)[0], v) for v in range(node_count)]
+    heapq.heapify(heap)
+    order = 0
+    while heap:
+        _, v = heapq.heappop(heap)
+        priority, shortcuts = simulate(v)
+        # Lazy update: the stored priority may be stale, so only contract if
+        # the fresh one is still the smallest.
+        if heap and priority > heap[0][0]:
+            heapq.heappush(heap, (priority, v))
+            continue
+
+        for u, x, w in shortcuts:
+            if w < out[u].get(x, INF):
+                out[u][x] = w
+                inn[x][u] = w
+        contracted[v] = True
+        rank[v] = order
+        order += 1
+        for nb in set(out[v]) | set(inn[v]):
+            if not contracted[nb]:
+                deleted_neighbors[nb] += 1
+
+    all_edges = [(u, v, w) for u in range(node_count) for v, w in out[u].items()]
+    return rank, all_edges
+
+
+def _upward(adj, start):
+    dist = {start: 0.0}
+    heap = [(0.0, start)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        for x, w in adj[u]:
+            nd = d + w
+            if nd < dist.get(x, INF):
+                dist[x] = nd
+                heapq.heappush(heap, (nd, x))
+    return dist
+
+
+def _meet(forward, backward):
+    if len(forward) > len(backward):
+        forward, backward = backward, forward
+    best = INF
+    for node, d in forward.items():
+        other = backward.get(node)
+        if other is not None and d + other < best:
+            best = d + other
+    return None if best == INF else best
+
+
+class RoadGraph:
+    def __init__(self, lats, lngs, rank, edges):
+        self.lats = lats
+        self.lngs = lngs
+        n = len(lats)
+        # up[u]: edges u -> v towards higher rank, for the forward search.
+        # down[v]: edges u -> v from higher rank, walked backwards from v.
+        self.up = [[] for _ in range(n)]
+        self.down = [[] for _ in range(n)]
+        for u, v, w in edges:
+            if rank[v] > rank[u]:
+                self.up[u].append((v, w))
+            else:
+                self.down[v].append((u, w))
+
+        self._grid = {}
+        for node in range(n):
+            self._grid.setdefault(self._grid_key(lats[node], lngs[node]), []).append(node)
+
+        if n:
+            self.bbox = (min(lats), min(lngs), max(lats), max(lngs))
+        else:
+            self.bbox = None
+
+    def __len__(self):
+        return len(self.lats)
+
+    @staticmethod
+    def _grid_key(lat, lng):
+        return (math.floor(lat / SNAP_GRID_DEG), math.floor(lng / SNAP_GRID_DEG))
+
+    @staticmethod
+    def _ring(ring):
+        if ring == 0:
+            yield 0, 0
+            return
+        for dx in range(-ring, ring + 1):
+            yield -ring, dx
+            yield ring, dx
+        for dy in range(-ring + 1, ring):
+            yield dy, -ring
+            yield dy, ring
+
+    def nearest(self, lat, lng):
+        """Closest graph node within MAX_SNAP_KM, or None."""
+        if self.bbox is None:
+            return None
+        # Equirectangular distances are plenty accurate at snapping range.
+        k = math.cos(math.radians(lat))
+        k_floor = max(k, MIN_LNG_SCALE)
+        margin_lat = MAX_SNAP_KM / 111.2
+        margin_lng = margin_lat / k_floor
+        min_lat, min_lng, max_lat, max_lng = self.bbox
+        if not (min_lat - margin_lat <= lat <= max_lat + margin_lat
+                and min_lng - margin_lng <= lng <= max_lng + margin_lng):
+            return None
+
+        gy, gx = self._grid_key(lat, lng)
+        cell_km = SNAP_GRID_DEG * 111.2 * k
+        best, best_sq = None, margin_lat ** 2
+        max_ring = int(MAX_SNAP_KM / (SNAP_GRID_DEG * 111.2 * k_floor)) + 1
+        for ring in range(max_ring + 1):
+            for dy, dx in self._ring(ring):
+                for node in self._grid.get((gy + dy, gx + dx), ()):
+                    d_lat = self.lats[node] - lat
+                    d_lng = (self.lngs[node] - lng) * k
+                    sq = d_lat * d_lat + d_lng * d_lng
+                    if sq < best_sq:
+                        best, best_sq = node, sq
+            # Every node in a later ring is at least `ring` cells away.
+            if best is not None and math.sqrt(best_sq) * 111.2 <= ring * cell_km:
+                break
+        return best
+
+    def forward(self, node):
+        return _upward(self.up, node)
+
+    def backward(self, node):
+        return _upward(self.down, node)
+
+    def travel_time(self, source, target):
+        return _meet(self.forward(source), self.backward(target))
+
+
+def load_graph(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        data = json.load(f)
+    lats, lngs, edges = data["lat"], data["lng"], data["edges"]
+    rank = data.get("rank")
+    if rank is None:
+        logger.warning(f"Road graph {path} has no hierarchy, contracting {len(lats)} nodes at startup")
+        rank, edges = contract(len(lats), edges)
+    return RoadGraph(lats, lngs, rank, edges)
+
+
+class Router:
+    """Travel times in seconds between (lat, lng) points, cached per cell pair."""
+
+    def __init__(self, graph=None, cell_deg=ROUTE_CELL_DEG, cache_size=ROUTE_CACHE_SIZE):
+        self.graph = graph
+        self.cell_deg = cell_deg
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cell(self, point):
+        return (math.floor(point[0] / self.cell_deg), math.floor(point[1] / self.cell_deg))
+
+    def _fallback(self, source, target):
+        km = calculate_distance(source[0], source[1], target[0], target[1])
+        return km / FALLBACK_SPEED_KMH * 3600
+
+    def _cached(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return True, self._cache[key]
+        return False, None
+
+    def _store(self, key, seconds):
+        with self._lock:
+            self._cache[key] = seconds
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _solve(self, one, many, one_is_target):
+        results = [None] * len(many)
+        missing = []
+        one_cell = self._cell(one)
+        for i, point in enumerate(many):
+            key = (self._cell(point), one_cell) if one_is_target else (one_cell, self._cell(point))
+            hit, seconds = self._cached(key)
+            if hit:
+                results[i] = seconds
+            else:
+                missing.append((i, key))
+        if not missing:
+            return results
+
+        graph = self.graph
+        one_node = graph.nearest(one[0], one[1]) if graph else None
+        # The search from the shared endpoint is done once and reused for every pair.
+        one_space = None
+        if one_node is not None:
+            one_space = graph.backward(one_node) if one_is_target else graph.forward(one_node)
+
+        for i, key in missing:
+            point = many[i]
+            node = graph.nearest(point[0], point[1]) if one_space is not None else None
+            if node is None:
+                seconds = self._fallback(point, one) if one_is_target else self._fallback(one, point)
+            else:
+                other_space = graph.forward(node) if one_is_target else graph.backward(node)
+                seconds = _meet(other_space, one_space)
+            self._store(key, seconds)
+            results[i] = seconds
+        return results
+
+    def travel_times(self, sources, target):
+        """Many-to-one: seconds from each source to `target` (None if unreachable)."""
+        return self._solve(target, sources, one_is_target=True)
+
+    def travel_times_from(self, source, targets):
+        """One-to-many: seconds from `source` to each target (None if unreachable)."""
+        return self._solve(source, targets, one_is_target=False)
+
+    def travel_time(self, source, target):
+        return self.travel_times([source], target)[0]
+
+
+def load_router():
+    if not ROAD_GRAPH_PATH:
+        logger.info("ROAD_GRAPH_PATH not set, using straight-line travel times")
+        return Router()
+    graph = load_graph(ROAD_GRAPH_PATH)
+    logger.info(f"Loaded road graph {ROAD_GRAPH_PATH} with {len(graph)} nodes")
+    return Router(graph)
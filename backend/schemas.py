@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field, validator
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 import re
 
 class UserCreate(BaseModel):
@@ -81,3 +81,19 @@ class MechanicInfo(BaseModel):
 
 class RequestWithMechanic(RequestResponse):
     mechanic: Optional[MechanicInfo] = None
+
+class TrackPosition(BaseModel):
+    lat: float
+    lng: float
+    ts: float
+
+class TrackPoint(TrackPosition):
+    seq: int
+
+class TrackResponse(BaseModel):
+    request_id: int
+    status: str
+    latest: Optional[TrackPosition] = None
+    points: List[TrackPoint] = []
+    cursor: int
+    eta_minutes: Optional[float] = None
@@ -0,0 +1,219 @@
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+# Per-job trail limits. A trail never holds more than TRAIL_CAPACITY points;
+# when it fills up the stored points are simplified and, if that is not
+# enough, the oldest ones are dropped.
+TRAIL_CAPACITY = 256
+SIMPLIFY_TOLERANCE_M = 15.0
+MIN_MOVE_M = 5.0
+
+# How often a mechanic without a trail may trigger a database lookup for an
+# en-route job, and how many finished jobs are remembered so a late resume
+# cannot bring their trail back.
+JOB_LOOKUP_INTERVAL_S = 60.0
+FINISHED_JOBS_REMEMBERED = 1024
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def _to_local_xy(lat, lng, ref_lat):
+    # Equirectangular projection, accurate enough over a single trip.
+    k = math.cos(math.radians(ref_lat))
+    return (math.radians(lng) * k * EARTH_RADIUS_M,
+            math.radians(lat) * EARTH_RADIUS_M)
+
+
+def _segment_distance(px, py, ax, ay, bx, by):
+    dx = bx - ax
+    dy = by - ay
+    if dx == 0 and dy == 0:
+        return math.hypot(px - ax, py - ay)
+    t = ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)
+    t = max(0.0, min(1.0, t))
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def simplify(lats, lngs, tolerance_m):
+    """Ramer-Douglas-Peucker: return the indexes of the points to keep."""
+    n = len(lats)
+    if n <= 2:
+        return list(range(n))
+
+    ref_lat = lats[0]
+    xy = [_to_local_xy(lats[i], lngs[i], ref_lat) for i in range(n)]
+    keep = [False] * n
+    keep[0] = keep[n - 1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xy[first]
+        bx, by = xy[last]
+        max_dist = 0.0
+        index = first
+        for i in range(first + 1, last):
+            d = _segment_distance(xy[i][0], xy[i][1], ax, ay, bx, by)
+            if d > max_dist:
+                max_dist = d
+                index = i
+        if max_dist > tolerance_m:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [i for i in range(n) if keep[i]]
+
+
+class PositionTrail:
+    """Bounded, array-backed position history for one active job.
+
+    Every stored point gets a strictly increasing sequence number, derived
+    from its timestamp in milliseconds, which clients use as a cursor.
+    Simplification removes points but never renumbers the ones it keeps, and
+    a trail rebuilt after a restart keeps numbering after the old one.
+    """
+
+    def __init__(self, capacity=TRAIL_CAPACITY, tolerance_m=SIMPLIFY_TOLERANCE_M):
+        self.capacity = capacity
+        self.tolerance_m = tolerance_m
+        self.lats = array("d")
+        self.lngs = array("d")
+        self.times = array("d")
+        self.seqs = array("q")
+        self.last_seq = 0
+        self.latest = None
+
+    def __len__(self):
+        return len(self.seqs)
+
+    def append(self, lat, lng, ts):
+        self.latest = (lat, lng, ts)
+
+        if self.seqs:
+            last_lat = self.lats[-1]
+            x0, y0 = _to_local_xy(last_lat, self.lngs[-1], last_lat)
+            x1, y1 = _to_local_xy(lat, lng, last_lat)
+            if math.hypot(x1 - x0, y1 - y0) < MIN_MOVE_M:
+                return
+
+        if len(self.seqs) >= self.capacity:
+            self._compact()
+
+        self.lats.append(lat)
+        self.lngs.append(lng)
+        self.times.append(ts)
+        self.last_seq = max(self.last_seq + 1, int(ts * 1000))
+        self.seqs.append(self.last_seq)
+
+    def _compact(self):
+        keep = simplify(self.lats, self.lngs, self.tolerance_m)
+        # Simplification alone can't bound a trail that keeps turning, so
+        # fall back to dropping the oldest points until half the capacity is free.
+        limit = self.capacity // 2
+        if len(keep) > limit:
+            keep = keep[-limit:]
+        self.lats = array("d", (self.lats[i] for i in keep))
+        self.lngs = array("d", (self.lngs[i] for i in keep))
+        self.times = array("d", (self.times[i] for i in keep))
+        self.seqs = array("q", (self.seqs[i] for i in keep))
+
+    def since(self, cursor):
+        """Return the points stored after `cursor` and the new cursor."""
+        start = len(self.seqs)
+        # seqs is sorted, so walk back from the end; clients polling
+        # regularly only ever need the last few points.
+        while start > 0 and self.seqs[start - 1] > cursor:
+            start -= 1
+        points = [
+            (self.seqs[i], self.lats[i], self.lngs[i], self.times[i])
+            for i in range(start, len(self.seqs))
+        ]
+        new_cursor = self.seqs[-1] if self.seqs else cursor
+        return points, max(cursor, new_cursor)
+
+
+class TrailStore:
+    """In-memory trails for jobs that are currently en route."""
+
+    def __init__(self, capacity=TRAIL_CAPACITY):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._trails = {}
+        self._job_by_mechanic = {}
+        self._finished = OrderedDict()
+        self._last_lookup = {}
+
+    def start(self, request_id, mechanic_id, lat=None, lng=None):
+        with self._lock:
+            old_job = self._job_by_mechanic.get(mechanic_id)
+            if old_job is not None and old_job != request_id:
+                self._trails.pop(old_job, None)
+            trail = self._trails.get(request_id)
+            if trail is None:
+                trail = PositionTrail(self.capacity)
+                self._trails[request_id] = trail
+            self._job_by_mechanic[mechanic_id] = request_id
+            self._finished.pop(request_id, None)
+            if lat is not None and lng is not None:
+                trail.append(lat, lng, time.time())
+
+    def resume(self, request_id, mechanic_id, lat=None, lng=None):
+        """Recreate a trail lost in a restart. Never replaces or revives one.
+
+        Returns True if the job has a trail afterwards.
+        """
+        with self._lock:
+            if request_id in self._trails:
+                return True
+            if request_id in self._finished or mechanic_id in self._job_by_mechanic:
+                return False
+            trail = PositionTrail(self.capacity)
+            self._trails[request_id] = trail
+            self._job_by_mechanic[mechanic_id] = request_id
+            if lat is not None and lng is not None:
+                trail.append(lat, lng, time.time())
+            return True
+
+    def should_look_up(self, mechanic_id):
+        """Rate-limit job lookups for mechanics whose pings have no trail."""
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_lookup.get(mechanic_id)
+            if last is not None and now - last < JOB_LOOKUP_INTERVAL_S:
+                return False
+            self._last_lookup[mechanic_id] = now
+            return True
+
+    def stop(self, request_id):
+        with self._lock:
+            self._trails.pop(request_id, None)
+            self._finished[request_id] = True
+            if len(self._finished) > FINISHED_JOBS_REMEMBERED:
+                self._finished.popitem(last=False)
+            for mechanic_id, job_id in list(self._job_by_mechanic.items()):
+                if job_id == request_id:
+                    del self._job_by_mechanic[mechanic_id]
+
+    def record(self, mechanic_id, lat, lng):
+        with self._lock:
+            request_id = self._job_by_mechanic.get(mechanic_id)
+            if request_id is None:
+                return False
+            self._trails[request_id].append(lat, lng, time.time())
+            return True
+
+    def snapshot(self, request_id, cursor=0):
+        """Return (latest, points, cursor) for a job, or None if untracked."""
+        with self._lock:
+            trail = self._trails.get(request_id)
+            if trail is None:
+                return None
+            points, new_cursor = trail.since(cursor)
+            return trail.latest, points, new_cursor
+
+
+trails = TrailStore()